@@ -1,8 +1,13 @@
+import os
+
 import streamlit as st
 import pandas as pd
+import polars as pl
 import numpy as np
 import altair as alt
 
+from kernels import count_deficit_days, soc_trace
+
 
 # --------------------------------------------------
 # Configuración de la página
@@ -31,17 +36,105 @@ Cálculos que realiza:
 
 st.divider()
 
+# --------------------------------------------------
+# Parámetros del sistema
+# --------------------------------------------------
+# Agrupados en un formulario: el script solo se vuelve a ejecutar al pulsar
+# "Calcular", no con cada cambio de un número o del slider.
+with st.sidebar.form("params"):
+    st.header("⚙️ Parámetros")
+
+    st.subheader("Panel fotovoltaico")
+    panel_kw = st.number_input(
+        "Potencia del panel fotovoltaico [kW]",
+        min_value=0.1,
+        max_value=50.0,
+        value=1.0,
+        step=0.1,
+    )
+
+    st.subheader("Rendimientos")
+    eta_fv = st.number_input(
+        "η_fv (rendimiento FV)",
+        min_value=0.0, max_value=1.0, value=0.90, step=0.01
+    )
+    eta_cableado = st.number_input(
+        "η_cableado",
+        min_value=0.0, max_value=1.0, value=0.98, step=0.01
+    )
+    eta_mppt = st.number_input(
+        "η_MPPT / regulador",
+        min_value=0.0, max_value=1.0, value=0.96, step=0.01
+    )
+    eta_bat = st.number_input(
+        "η_batería (carga/descarga)",
+        min_value=0.0, max_value=1.0, value=0.90, step=0.01
+    )
+
+    st.subheader("Batería")
+    V_bat = st.number_input(
+        "Voltaje nominal batería [V]",
+        min_value=1.0, max_value=1000.0, value=12.0, step=1.0
+    )
+    C_bat_Ah = st.number_input(
+        "Capacidad nominal batería [Ah]",
+        min_value=1.0, max_value=10000.0, value=250.0, step=1.0
+    )
+    DoD_pct = st.number_input(
+        "Profundidad máxima de descarga DoD [%]",
+        min_value=0.0, max_value=100.0, value=80.0, step=1.0
+    )
+    soc_init_pct = st.slider(
+        "SoC inicial de la batería [% de la capacidad máxima]",
+        min_value=0, max_value=100, value=100, step=1
+    )
+
+    st.form_submit_button("Calcular")
+
 # --------------------------------------------------
 # 1. Lectura directa de tus archivos Excel
 # --------------------------------------------------
 st.header("1️⃣ Lectura de datos desde los archivos fijos")
 
-try:
-    # consumo_diario.xlsx: tiene encabezados reales en la fila 2 (índice 1)
-    df_consumo = pd.read_excel("consumo_diario.xlsx", header=1)
-    
+# Cacheamos la lectura: la fecha de modificación de cada archivo forma parte
+# de la clave, así que editar un Excel invalida la caché automáticamente.
+# Usamos el motor calamine (Rust), bastante más rápido que openpyxl, y
+# devolvemos tablas Polars: pandas solo se usa en la frontera con Streamlit.
+@st.cache_data
+def load_inputs(consumo_path: str, gen_path: str, consumo_mtime: float, gen_mtime: float):
+    # consumo_diario.xlsx: tiene encabezados reales en la fila 2 (índice 1) y la
+    # tabla no empieza en A1; pandas respeta esa posición absoluta de la cabecera
+    df_consumo = pl.from_pandas(pd.read_excel(consumo_path, header=1, engine="calamine"))
+
     # energia_generada.xlsx: cabecera normal en la primera fila
-    df_generacion = pd.read_excel("energia_generada.xlsx")
+    df_generacion = pl.read_excel(gen_path, engine="calamine")
+
+    # Convertimos, limpiamos y ordenamos las fechas una sola vez por versión del
+    # archivo. Las celdas de fecha de Excel ya llegan como fecha; si vinieran como
+    # texto, un formato explícito evita la detección automática (mucho más lenta).
+    if "fecha" in df_generacion.columns:
+        fecha = pl.col("fecha")
+        if df_generacion.schema["fecha"] == pl.String:
+            fecha = fecha.str.to_datetime("%Y-%m-%d", strict=False)
+        else:
+            fecha = fecha.cast(pl.Datetime, strict=False)
+
+        df_generacion = (
+            df_generacion.with_columns(fecha)
+            .drop_nulls("fecha")
+            .sort("fecha")
+        )
+
+    return df_consumo, df_generacion
+
+
+try:
+    df_consumo, df_generacion = load_inputs(
+        "consumo_diario.xlsx",
+        "energia_generada.xlsx",
+        os.path.getmtime("consumo_diario.xlsx"),
+        os.path.getmtime("energia_generada.xlsx"),
+    )
 
 except FileNotFoundError as e:
     st.error(
@@ -69,7 +162,14 @@ if "ENERGIA (Wh)" not in df_consumo.columns:
     st.error("En `consumo_diario.xlsx` no se ha encontrado la columna 'ENERGIA (Wh)'.")
     st.stop()
 
-consumo_total_Wh = df_consumo["ENERGIA (Wh)"].sum()
+energia_wh = df_consumo["ENERGIA (Wh)"]
+if not energia_wh.dtype.is_numeric():
+    st.error("En `consumo_diario.xlsx` la columna 'ENERGIA (Wh)' debe ser numérica.")
+    st.stop()
+
+# Suma directa sobre el ndarray; drop_nulls es solo una protección por si
+# alguna celda de la columna estuviera vacía (la suma de NumPy no las omite)
+consumo_total_Wh = float(energia_wh.drop_nulls().cast(pl.Float64).to_numpy().sum())
 consumo_total_kWh = consumo_total_Wh / 1000.0
 
 st.markdown(
@@ -99,33 +199,30 @@ if col_fecha not in df_generacion.columns or col_gen not in df_generacion.column
     st.stop()
 
 # Renombramos para trabajar más cómodo
-df_gen = df_generacion[[col_fecha, col_gen]].copy()
-df_gen.columns = ["fecha", "energia_1kw_kwh"]
-df_gen["fecha"] = pd.to_datetime(df_gen["fecha"], errors="coerce")
-df_gen = df_gen.dropna(subset=["fecha"]).sort_values("fecha")
+# (las fechas ya vienen convertidas, sin nulos y ordenadas desde load_inputs)
+df_gen = df_generacion.select(
+    pl.col(col_fecha).alias("fecha"),
+    pl.col(col_gen).cast(pl.Float64).alias("energia_1kw_kwh"),
+)
+
+# Serie de generación como ndarray float64, reutilizada en el barrido (sección 7)
+gen_1kw = df_gen["energia_1kw_kwh"].to_numpy()
 
 st.markdown(
     """
 Los datos de generación están expresados como **kWh/día para un panel de 1 kW**.
-Puedes introducir ahora la potencia real del panel para escalar la energía generada.
+La potencia real del panel (barra lateral) se usa para escalar la energía generada.
 """
 )
 
-panel_kw = st.number_input(
-    "Potencia del panel fotovoltaico [kW]",
-    min_value=0.1,
-    max_value=50.0,
-    value=1.0,
-    step=0.1,
-)
-df_gen["energia_kwh"] = df_gen["energia_1kw_kwh"] * panel_kw
-
 st.markdown(
     f"Energía generada diaria = `energia_1kw_kwh × {panel_kw} kW` → columna **energia_kwh**"
 )
 
 with st.expander("Ver datos de generación procesados"):
-    st.dataframe(df_gen.head())
+    st.dataframe(
+        df_gen.head().with_columns(energia_kwh=pl.col("energia_1kw_kwh") * panel_kw)
+    )
 
 st.divider()
 
@@ -134,29 +231,6 @@ st.divider()
 # --------------------------------------------------
 st.header("4️⃣ Eficiencia global y demanda diaria")
 
-col_e1, col_e2, col_e3, col_e4 = st.columns(4)
-
-with col_e1:
-    eta_fv = st.number_input(
-        "η_fv (rendimiento FV)",
-        min_value=0.0, max_value=1.0, value=0.90, step=0.01
-    )
-with col_e2:
-    eta_cableado = st.number_input(
-        "η_cableado",
-        min_value=0.0, max_value=1.0, value=0.98, step=0.01
-    )
-with col_e3:
-    eta_mppt = st.number_input(
-        "η_MPPT / regulador",
-        min_value=0.0, max_value=1.0, value=0.96, step=0.01
-    )
-with col_e4:
-    eta_bat = st.number_input(
-        "η_batería (carga/descarga)",
-        min_value=0.0, max_value=1.0, value=0.90, step=0.01
-    )
-
 eta_global = eta_fv * eta_cableado * eta_mppt * eta_bat
 
 st.markdown(
@@ -178,21 +252,29 @@ if eta_global <= 0:
 # Demanda diaria equivalente (constante todos los días)
 demanda_kwh = consumo_total_kWh / eta_global
 
-# Demanda diaria equivalente (constante todos los días)
-demanda_kwh = consumo_total_kWh / eta_global
-
 st.markdown("**Demanda diaria equivalente** (incluyendo pérdidas del sistema):")
 
 st.latex(
     rf"\text{{demanda}} = \frac{{{consumo_total_kWh:.3f}\,\text{{kWh}}}}{{\eta_{{global}}}} = {demanda_kwh:.3f}\,\text{{kWh/día}}"
 )
 
-# Creamos dataframe de simulación
-df = df_gen.copy()
-df["consumo_kwh"] = consumo_total_kWh
-df["demanda_kwh"] = demanda_kwh
-df["balance_kwh"] = df["energia_kwh"] - df["demanda_kwh"]
-df["balance_Wh"] = df["balance_kwh"] * 1000.0
+# Creamos dataframe de simulación (un único pipeline lazy de Polars). Todas las
+# columnas salen de una sola proyección: el balance resta la demanda como
+# escalar y la subexpresión común se evalúa una vez, sin tablas intermedias.
+energia = pl.col("energia_1kw_kwh") * panel_kw
+balance = energia - demanda_kwh
+
+df = (
+    df_gen.lazy()
+    .with_columns(
+        energia_kwh=energia,
+        consumo_kwh=pl.lit(consumo_total_kWh),
+        demanda_kwh=pl.lit(demanda_kwh),
+        balance_kwh=balance,
+        balance_Wh=balance * 1000.0,
+    )
+    .collect()
+)
 
 st.divider()
 
@@ -201,26 +283,10 @@ st.divider()
 # --------------------------------------------------
 st.header("5️⃣ Parámetros de la batería y simulación del SoC")
 
-col_b1, col_b2, col_b3 = st.columns(3)
-
-with col_b1:
-    V_bat = st.number_input(
-        "Voltaje nominal batería [V]",
-        min_value=1.0, max_value=1000.0, value=12.0, step=1.0
-    )
-with col_b2:
-    C_bat_Ah = st.number_input(
-        "Capacidad nominal batería [Ah]",
-        min_value=1.0, max_value=10000.0, value=250.0, step=1.0
-    )
-with col_b3:
-    DoD_pct = st.number_input(
-        "Profundidad máxima de descarga DoD [%]",
-        min_value=0.0, max_value=100.0, value=80.0, step=1.0
-    )
-
 E_max_Wh = V_bat * C_bat_Ah
-E_min_Wh = E_max_Wh * (1 - DoD_pct / 100.0)
+# Fracción de la capacidad que debe quedar siempre (se reutiliza en la sección 7)
+dod_factor = 1.0 - DoD_pct / 100.0
+E_min_Wh = E_max_Wh * dod_factor
 
 st.markdown(
     f"""
@@ -229,35 +295,38 @@ st.markdown(
 """
 )
 
-soc_init_pct = st.slider(
-    "SoC inicial de la batería [% de la capacidad máxima]",
-    min_value=0, max_value=100, value=100, step=1
-)
 SoC0_Wh = E_max_Wh * soc_init_pct / 100.0
 
 st.markdown(
     f"SoC inicial = **{SoC0_Wh:.1f} Wh**  ({soc_init_pct} % de {E_max_Wh:.1f} Wh)"
 )
 
-# Cálculo de SoC día a día
-soc_list = []
-soc = SoC0_Wh
+# Cálculo de SoC día a día (kernel Numba de kernels.py)
+soc_Wh = soc_trace(df["balance_Wh"].to_numpy(), float(SoC0_Wh), float(E_max_Wh))
 
-for b in df["balance_Wh"].values:
-    soc = soc + b
-    # Limitamos físicamente entre 0 y E_max
-    if soc > E_max_Wh:
-        soc = E_max_Wh
-    if soc < 0:
-        soc = 0
-    soc_list.append(soc)
-
-df["SoC_Wh"] = soc_list
-df["SoC_%"] = df["SoC_Wh"] / E_max_Wh * 100.0
-df["bateria_por_debajo_min"] = df["SoC_Wh"] < E_min_Wh
+df = df.with_columns(SoC_Wh=pl.Series(soc_Wh)).with_columns(
+    (pl.col("SoC_Wh") / E_max_Wh * 100.0).alias("SoC_%"),
+    bateria_por_debajo_min=pl.col("SoC_Wh") < E_min_Wh,
+)
 
 dias_sin_bateria = int(df["bateria_por_debajo_min"].sum())
 
+# Los cálculos ya están hechos en float64; para tablas y gráficos basta float32
+# (los datos de entrada no tienen más de ~4 cifras significativas)
+columnas_sim = [
+    "energia_kwh",
+    "consumo_kwh",
+    "demanda_kwh",
+    "balance_kwh",
+    "balance_Wh",
+    "SoC_Wh",
+    "SoC_%",
+]
+df = df.with_columns(
+    pl.col(columnas_sim).cast(pl.Float32),
+    pl.col("bateria_por_debajo_min").cast(pl.Boolean),
+)
+
 st.divider()
 
 # --------------------------------------------------
@@ -265,6 +334,9 @@ st.divider()
 # --------------------------------------------------
 st.header("6️⃣ Resultados globales")
 
+# Frontera con Streamlit/Altair: pasamos a pandas respaldado por Arrow (sin copia)
+df = df.to_pandas(use_pyarrow_extension_array=True)
+
 col_k1, col_k2, col_k3 = st.columns(3)
 
 with col_k1:
@@ -275,6 +347,9 @@ with col_k3:
     st.metric("Días sin batería", dias_sin_bateria)
 
 st.subheader("Tabla de resultados por día")
+
+# df ya viene respaldado por Arrow desde la conversión de Polars (sección 6),
+# así que Streamlit lo serializa sin inferir tipos
 st.dataframe(
     df[[
         "fecha",
@@ -285,30 +360,60 @@ st.dataframe(
         "SoC_Wh",
         "SoC_%",
         "bateria_por_debajo_min"
-    ]].set_index("fecha")
+    ]].set_index("fecha"),
+    height=320,
 )
 
+# Gráficos de líneas construidos directamente con Altair (sin reindexar df),
+# con tooltips y zoom/desplazamiento como los de st.line_chart
 st.subheader("📈 Generación y demanda energética anual [kWh]")
-st.line_chart(
-    df.set_index("fecha")[[ 
-        "demanda_kwh",
-        "energia_kwh",
-    ]]
+
+largo = df[["fecha", "demanda_kwh", "energia_kwh"]].melt(
+    "fecha", var_name="serie", value_name="kwh"
+)
+
+chart_energia = (
+    alt.Chart(largo)
+    .mark_line()
+    .encode(
+        x=alt.X("fecha:T", title="Fecha"),
+        y=alt.Y("kwh:Q", title="Energía (kWh)"),
+        color=alt.Color("serie:N", title="Serie"),
+        tooltip=[
+            alt.Tooltip("fecha:T", title="Fecha"),
+            alt.Tooltip("serie:N", title="Serie"),
+            alt.Tooltip("kwh:Q", title="Energía (kWh)"),
+        ],
+    )
+    .properties(width="container", height=350)
+    .interactive()
 )
 
+st.altair_chart(chart_energia, use_container_width=True)
+
 st.subheader("📉 Estado de carga de la batería (SoC) [%]")
-st.line_chart(
-    df.set_index("fecha")[[
-        "SoC_%"
-    ]]
+
+chart_soc = (
+    alt.Chart(df[["fecha", "SoC_%"]])
+    .mark_line()
+    .encode(
+        x=alt.X("fecha:T", title="Fecha"),
+        y=alt.Y("SoC_%:Q", title="SoC (%)"),
+        tooltip=[
+            alt.Tooltip("fecha:T", title="Fecha"),
+            alt.Tooltip("SoC_%:Q", title="SoC (%)"),
+        ],
+    )
+    .properties(width="container", height=350)
+    .interactive()
 )
 
+st.altair_chart(chart_soc, use_container_width=True)
+
 st.subheader("📉 Balance energético anual [kWh]")
 
 # Color condicional para excedente / déficit
-df["color"] = df["balance_kwh"].apply(
-    lambda x: "EXCEDENTE" if x >= 0 else "DEFICIT"
-)
+df["color"] = np.where(df["balance_kwh"].to_numpy() >= 0, "EXCEDENTE", "DEFICIT")
 
 chart_balance = (
     alt.Chart(df)
@@ -370,87 +475,79 @@ colores_pv = {
     "2 × 500W": "#4DAF4A",  # verde
 }
 
-# Función para calcular días sin suministro
-def sim_dias_sin(panel_kw: float, bat_Wh: float) -> int:
-    E_max_Wh = bat_Wh
-    E_min_Wh = E_max_Wh * (1 - DoD_pct / 100.0)
-    soc = E_max_Wh
-    dias_sin = 0
-
-    for energia_1kw in df_gen["energia_1kw_kwh"]:
-        energia_kwh = energia_1kw * panel_kw
-        balance_kwh = energia_kwh - demanda_kwh
-        soc += balance_kwh * 1000.0
-
-        # límites físicos
-        soc = min(soc, E_max_Wh)
-        soc = max(soc, 0)
-
-        if soc < E_min_Wh:
-            dias_sin += 1
-
-    return dias_sin
-
-# Construir tabla
-rows = []
-for bat_Wh in lista_bat_Wh:
-    for pv_kw in lista_pv_kw:
-        dias_sin = sim_dias_sin(pv_kw, bat_Wh)
-        etiqueta = etiquetas_pv[pv_kw]
-        rows.append(
-            {
-                "E_bateria_Wh": bat_Wh,
-                "Potencia_label": etiqueta,
-                "Dias_sin": dias_sin,
-            }
-        )
+# El barrido solo depende de la demanda, del DoD y de la serie de generación
+# (no de panel_kw, V_bat, C_bat_Ah ni del SoC inicial): lo cacheamos para no
+# repetir las simulaciones cada vez que se mueve otro parámetro
+@st.cache_data
+def compute_sweep(
+    demanda_kwh: float,
+    gen_1kw: np.ndarray,
+    lista_bat: list,
+    e_min_bat: np.ndarray,
+    lista_pv: list,
+    etiquetas: dict,
+) -> pd.DataFrame:
+    bat = np.array(lista_bat, dtype=np.float64)
+    pv = np.array(lista_pv, dtype=np.float64)
+
+    # Balance diario [Wh] por potencia FV, forma (n_pv, n_días); no depende de la batería
+    balance_pv_Wh = (gen_1kw[None, :] * pv[:, None] - demanda_kwh) * 1000.0
+
+    dias_sin_matriz = count_deficit_days(balance_pv_Wh, bat, e_min_bat)
+
+    # Construir tabla directamente por columnas (orden: batería, después potencia FV).
+    # La etiqueta es categórica: 5 valores repetidos, en el orden de la leyenda.
+    labels = [etiquetas[p] for p in lista_pv]
+    return pd.DataFrame(
+        {
+            "E_bateria_Wh": np.repeat(lista_bat, len(lista_pv)),
+            "Potencia_label": pd.Categorical(
+                np.tile(labels, len(lista_bat)), categories=labels, ordered=True
+            ),
+            "Dias_sin": dias_sin_matriz.ravel(),
+        }
+    )
 
-df_excel = pd.DataFrame(rows)
 
-# Gráfico tipo Excel
-chart = (
-    alt.Chart(df_excel)
-    .mark_line(point=True, strokeWidth=2)
-    .encode(
-        x=alt.X("E_bateria_Wh:Q", title="Energía batería (Wh)"),
-        y=alt.Y("Dias_sin:Q", title="Días sin suministro"),
-        color=alt.Color(
-            "Potencia_label:N",
-            title="Potencia FV",
-            scale=alt.Scale(domain=list(colores_pv.keys()),
-                            range=list(colores_pv.values())),
-        ),
-        tooltip=[
-            alt.Tooltip("E_bateria_Wh:Q", title="Energía batería (Wh)"),
-            alt.Tooltip("Potencia_label:N", title="Potencia FV"),
-            alt.Tooltip("Dias_sin:Q", title="Días sin suministro"),
-        ],
-    )
-    .properties(width="container", height=400)
+# Capacidad mínima de cada batería del barrido, con el mismo DoD que la sección 5
+e_min_bat = np.asarray(lista_bat_Wh, dtype=np.float64) * dod_factor
+
+df_excel = compute_sweep(
+    demanda_kwh, gen_1kw, lista_bat_Wh, e_min_bat, lista_pv_kw, etiquetas_pv
 )
 
-# Añadir etiquetas como números sobre cada punto
-text = (
-    alt.Chart(df_excel)
-    .mark_text(
-        align='left',
-        baseline='middle',
-        dx=6,       # separación horizontal
-        dy=-6,      # separación vertical
-        fontSize=12
-    )
-    .encode(
-        x="E_bateria_Wh:Q",
-        y="Dias_sin:Q",
-        text="Dias_sin:Q",
-        color=alt.Color(
-            "Potencia_label:N",
-            scale=alt.Scale(domain=list(colores_pv.keys()),
-                            range=list(colores_pv.values())),
-        )
-    )
+# Gráfico tipo Excel: línea y etiquetas parten de la misma base, así la
+# codificación de ejes y color se declara una sola vez para ambas capas
+base = alt.Chart(df_excel).encode(
+    x=alt.X("E_bateria_Wh:Q", title="Energía batería (Wh)"),
+    y=alt.Y("Dias_sin:Q", title="Días sin suministro"),
+    color=alt.Color(
+        "Potencia_label:N",
+        title="Potencia FV",
+        scale=alt.Scale(domain=list(colores_pv.keys()),
+                        range=list(colores_pv.values())),
+    ),
 )
 
-# Mostrar gráfico final
-st.altair_chart(chart + text, use_container_width=True)
+chart = base.mark_line(point=True, strokeWidth=2).encode(
+    tooltip=[
+        alt.Tooltip("E_bateria_Wh:Q", title="Energía batería (Wh)"),
+        alt.Tooltip("Potencia_label:N", title="Potencia FV"),
+        alt.Tooltip("Dias_sin:Q", title="Días sin suministro"),
+    ],
+)
 
+# Añadir etiquetas como números sobre cada punto
+text = base.mark_text(
+    align='left',
+    baseline='middle',
+    dx=6,       # separación horizontal
+    dy=-6,      # separación vertical
+    fontSize=12
+).encode(text="Dias_sin:Q")
+
+# Mostrar gráfico final
+st.altair_chart(
+    (chart + text).properties(width="container", height=400),
+    use_container_width=True,
+)
@@ -0,0 +1,61 @@
+import numpy as np
+import numba
+
+
+# --------------------------------------------------
+# Kernels numéricos compilados con Numba
+# --------------------------------------------------
+# Viven en un módulo aparte (y no en app.py) porque Streamlit vuelve a ejecutar
+# el script entero en cada interacción: definidos aquí, el dispatcher se crea
+# una sola vez por proceso y la compilación se reutiliza entre ejecuciones.
+
+
+# Límite físico de la batería: el SoC no puede superar E_max ni bajar de 0.
+# Compartido por los dos kernels para que apliquen exactamente la misma recurrencia.
+@numba.njit(cache=True)
+def clip_soc(s: float, e_max: float) -> float:
+    if s > e_max:
+        return e_max
+    if s < 0.0:
+        return 0.0
+    return s
+
+
+# SoC día a día: el límite físico [0, E_max] hace que el SoC dependa del día
+# anterior, así que no es un simple cumsum
+@numba.njit(cache=True)
+def soc_trace(balance_Wh: np.ndarray, soc0: float, e_max: float) -> np.ndarray:
+    out = np.empty_like(balance_Wh)
+    s = soc0
+    for i in range(balance_Wh.size):
+        s = clip_soc(s + balance_Wh[i], e_max)
+        out[i] = s
+    return out
+
+
+# Días sin suministro para cada par (batería, potencia FV). Es la misma
+# recurrencia que soc_trace (vía clip_soc), pero contando el déficit sobre la
+# marcha sin guardar la traza; E_max y E_min de cada batería van en locales.
+# Sin parallel/prange: 25 pares × 365 días es muy poco trabajo para compensar
+# el arranque de hilos.
+@numba.njit(cache=True)
+def count_deficit_days(balance, e_max_per_bat, e_min_per_bat):
+    n_bat = e_max_per_bat.size
+    n_pv, n_dias = balance.shape
+    out = np.empty((n_bat, n_pv), dtype=np.int32)
+
+    for i in range(n_bat):
+        e_max = e_max_per_bat[i]
+        e_min = e_min_per_bat[i]
+
+        for j in range(n_pv):
+            # La batería empieza cargada al 100 %
+            soc = e_max
+            deficit = 0
+            for d in range(n_dias):
+                soc = clip_soc(soc + balance[j, d], e_max)
+                if soc < e_min:
+                    deficit += 1
+            out[i, j] = deficit
+
+    return out